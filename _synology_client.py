@@ -0,0 +1,435 @@
+"""
+Shared helpers for the Synology Download Station test scripts
+"""
+
+import atexit
+import functools
+import json
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+from types import MappingProxyType
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# orjson parses response bytes directly and faster; json.loads accepts bytes too
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+
+# Response decoder for scripts that keep their own requests session
+loads = _json.loads
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Disable SSL warnings for testing (remove in production)
+requests.packages.urllib3.disable_warnings()
+
+# One pooled session per process, shared by every script that imports this
+# module, so connections (and TLS sessions) are set up once. Rate-limited
+# (429) responses are retried with exponential backoff, including the POST
+# task creates: a 429 means DSM did not process the request. Read errors
+# are not retried, since a POST may already have been applied.
+SESSION = requests.Session()
+SESSION.verify = False
+SESSION.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4,
+                                     max_retries=Retry(total=2, read=0, backoff_factor=0.2,
+                                                       status_forcelist=(429,),
+                                                       allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {'POST'})))
+atexit.register(SESSION.close)
+
+# Error messages for SYNO.API.Auth login failures
+AUTH_ERRORS = MappingProxyType({
+    400: "No such account or incorrect password",
+    401: "Account disabled",
+    402: "Permission denied",
+    403: "2-step verification code required",
+    404: "Failed to authenticate 2-step verification code"
+})
+
+# Error messages for SYNO.DownloadStation.Task failures
+TASK_ERRORS = MappingProxyType({
+    400: "File upload failed",
+    401: "Max number of tasks reached",
+    402: "Destination denied",
+    403: "Destination does not exist",
+    404: "Invalid task id",
+    405: "Invalid task action",
+    406: "No default destination",
+    407: "Set destination failed",
+    408: "File does not exist"
+})
+
+# Delays between BTSearch list polls; searches often finish well under a second
+SEARCH_POLL_DELAYS = (0.2, 0.4, 0.6, 0.8, 1.0, 1.5)
+
+# SYNO.API.Info results are cached on disk; paths only change with DSM upgrades
+API_INFO_CACHE_FILE = Path.home() / '.cache' / 'synology-mcp' / 'api_info.json'
+API_INFO_CACHE_TTL = 24 * 60 * 60
+
+# Logged-in sids kept between runs expire well before DSM's idle timeout
+SID_CACHE_TTL = 5 * 60
+
+@functools.lru_cache(maxsize=None)
+def _load_api_info_cache():
+    """Read the on-disk API info cache once per process"""
+    try:
+        with open(API_INFO_CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_api_info_cache(cache):
+    """Write the API info cache atomically, ignoring filesystem errors"""
+    try:
+        API_INFO_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = API_INFO_CACHE_FILE.with_suffix('.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp_file, API_INFO_CACHE_FILE)
+    except OSError:
+        pass
+
+def _sid_cache_file(host, username):
+    """Return the path of the sid cache file for host and username
+
+    It sits next to the API info cache; characters that are not safe in a
+    file name are replaced so the path cannot leave that directory.
+    """
+    safe_name = re.sub(r'[^A-Za-z0-9._-]', '_', f"{host}_{username}")
+    return API_INFO_CACHE_FILE.parent / f"sid_{safe_name}.json"
+
+def load_cached_sid(host, username):
+    """Return the sid cached for host and username, or None if missing or expired"""
+    cache_file = _sid_cache_file(host, username)
+    try:
+        if time.time() - cache_file.stat().st_mtime >= SID_CACHE_TTL:
+            return None
+        with open(cache_file) as f:
+            return json.load(f)['sid']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def store_cached_sid(host, username, sid):
+    """Write the sid cache file atomically and readable only by the current user"""
+    cache_file = _sid_cache_file(host, username)
+    try:
+        cache_file.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        fd, tmp_file = tempfile.mkstemp(dir=cache_file.parent, prefix=cache_file.name)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'sid': sid}, f)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+
+def clear_cached_sid(host, username):
+    """Remove the sid cache file once its session has been logged out"""
+    try:
+        _sid_cache_file(host, username).unlink()
+    except OSError:
+        pass
+
+def make_request(url, params=None, data=None):
+    """Make HTTP request and return JSON response
+
+    params may be omitted when url already carries the encoded query
+    string; data is sent as a POST form body.
+    """
+    try:
+        if data is None:
+            response = SESSION.get(url, params=params, timeout=10)
+        else:
+            response = SESSION.post(url, params=params, data=data, timeout=10)
+        return _json.loads(response.content)
+    except Exception as e:
+        print(f"Request failed: {e}")
+        return {'success': False, 'error': str(e)}
+
+def _cached_api_info(base_url, query):
+    """Return cached SYNO.API.Info data for query, or None if missing or expired"""
+    entry = _load_api_info_cache().get(f"{base_url}?query={query}")
+    if entry and time.time() - entry['time'] < API_INFO_CACHE_TTL:
+        return entry['data']
+    return None
+
+def _store_api_info(base_url, query, api_info):
+    """Add SYNO.API.Info data for query to the on-disk cache"""
+    cache = _load_api_info_cache()
+    cache[f"{base_url}?query={query}"] = {'time': time.time(), 'data': api_info}
+    _save_api_info_cache(cache)
+
+def drop_cached_api_info(base_url, query):
+    """Remove the cached SYNO.API.Info data for query so the next lookup re-queries it"""
+    cache = _load_api_info_cache()
+    if cache.pop(f"{base_url}?query={query}", None) is not None:
+        _save_api_info_cache(cache)
+
+def stale_api_info(data):
+    """Return whether a failed response suggests the API info used for it is out of date
+
+    A DSM upgrade can move or re-version an API, which shows up as a
+    non-JSON response (e.g. a 404 page) or errors 101-104 (invalid
+    parameter, unknown API, unknown method, unsupported version).
+    """
+    error = data.get('error')
+    return not isinstance(error, dict) or error.get('code') in (101, 102, 103, 104)
+
+def get_api_info_cached(base_url, query, fetch):
+    """Return the SYNO.API.Info response for query, skipping the request on a cache hit"""
+    api_info = _cached_api_info(base_url, query)
+    if api_info is not None:
+        return {'success': True, 'data': api_info}
+
+    params = {
+        'api': 'SYNO.API.Info',
+        'version': '1',
+        'method': 'query',
+        'query': query
+    }
+
+    data = fetch(f"{base_url}/query.cgi", params)
+    if data.get('success'):
+        _store_api_info(base_url, query, data['data'])
+    return data
+
+def wait_for_search(fetch_results):
+    """Poll a BTSearch list until the search finishes, backing off between polls
+
+    fetch_results is called after each delay and returns the list response;
+    the last response is returned whether or not the search finished.
+    """
+    for delay in SEARCH_POLL_DELAYS:
+        time.sleep(delay)
+        data = fetch_results()
+        if not data['success'] or data['data']['finished']:
+            break
+    return data
+
+class SynologySession:
+    """Context manager that logs in on entry and logs out on exit
+
+    Requests go through make_request, so login, logout and the calls
+    made inside the block all share one connection pool. When the API
+    info is not cached, the lookup and login are first tried as a single
+    compound request. If the API info lookup or login fails, the failure
+    is printed and sid stays None; callers should check it before using
+    the session.
+    """
+
+    def __init__(self, base_url, username, password, query):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.query = query
+        self.api_info = {}
+        self.sid = None
+
+    def _login_params(self):
+        """Build the SYNO.API.Auth login parameters"""
+        return {
+            'api': 'SYNO.API.Auth',
+            'version': '3',
+            'method': 'login',
+            'account': self.username,
+            'passwd': self.password,
+            'session': 'DownloadStation',
+            'format': 'sid'
+        }
+
+    def _print_login_failure(self, data):
+        """Print why a login failed, using the auth error table when possible"""
+        error = data.get('error')
+        code = error.get('code') if isinstance(error, dict) else None
+        print(f"Failed to login! {AUTH_ERRORS.get(code, f'Error: {error}')}")
+
+    def _compound_login(self):
+        """Query API info and log in with one SYNO.Entry.Request round trip
+
+        Returns (api_info, login_response), or None if the NAS rejected the
+        compound request or the API info query inside it failed. A failed
+        login is returned rather than retried, so a wrong password is only
+        sent once.
+        """
+        compound = [
+            {'api': 'SYNO.API.Info', 'version': 1, 'method': 'query', 'query': self.query},
+            self._login_params()
+        ]
+        params = {
+            'api': 'SYNO.Entry.Request',
+            'version': '1',
+            'method': 'request',
+            'stop_when_error': 'true',
+            'compound': json.dumps(compound)
+        }
+
+        data = make_request(f"{self.base_url}/entry.cgi", data=params)
+        if not data.get('success'):
+            return None
+
+        results = data['data'].get('result', [])
+        if len(results) != 2 or not results[0].get('success'):
+            return None
+        return results[0]['data'], results[1]
+
+    def __enter__(self):
+        # Without cached API info, try to fetch it and log in in one request
+        if _cached_api_info(self.base_url, self.query) is None:
+            compound = self._compound_login()
+            if compound:
+                self.api_info, data = compound
+                _store_api_info(self.base_url, self.query, self.api_info)
+                if not data.get('success'):
+                    self._print_login_failure(data)
+                    return self
+                self.sid = data['data']['sid']
+                return self
+
+        # Retry once with freshly queried API info if the cached paths look stale
+        for _ in range(2):
+            cached = _cached_api_info(self.base_url, self.query) is not None
+            data = get_api_info_cached(self.base_url, self.query, make_request)
+            if not data['success']:
+                print("Failed to get API info!")
+                return self
+
+            self.api_info = data['data']
+            auth_info = self.api_info['SYNO.API.Auth']
+            data = make_request(f"{self.base_url}/{auth_info['path']}", self._login_params())
+            if data.get('success') or not (cached and stale_api_info(data)):
+                break
+            drop_cached_api_info(self.base_url, self.query)
+
+        if not data.get('success'):
+            self._print_login_failure(data)
+            return self
+
+        self.sid = data['data']['sid']
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self.sid:
+            return
+
+        print("\nLogging out...")
+        auth_info = self.api_info['SYNO.API.Auth']
+        params = {
+            'api': 'SYNO.API.Auth',
+            'version': '1',
+            'method': 'logout',
+            'session': 'DownloadStation',
+            '_sid': self.sid
+        }
+
+        data = make_request(f"{self.base_url}/{auth_info['path']}", params)
+        if data['success']:
+            print("✓ Logged out successfully")
+        self.sid = None
+
+def _parent_node(data, path):
+    """Return the dict holding the last key of a dotted path, or None"""
+    node = data
+    for key in path.split('.')[:-1]:
+        node = node.get(key) if isinstance(node, dict) else None
+    return node if isinstance(node, dict) else None
+
+def stream_list_request(url, params, items_prefix, max_items):
+    """Fetch a list response, building only the first max_items list entries
+
+    items_prefix is the ijson prefix of the list entries, e.g.
+    'data.items.item'. With ijson installed the body is parsed straight
+    off the socket, so entries past max_items are never materialized;
+    otherwise the whole response is decoded and the list truncated.
+    """
+    list_path = items_prefix.rsplit('.', 1)[0]
+    list_key = list_path.rsplit('.', 1)[-1]
+    if ijson is None:
+        data = make_request(url, params)
+        parent = _parent_node(data, list_path)
+        if parent and isinstance(parent.get(list_key), list):
+            del parent[list_key][max_items:]
+        return data
+
+    try:
+        with SESSION.get(url, params=params, timeout=10, stream=True) as response:
+            response.raw.decode_content = True
+            data = {}
+            items = []
+            builder = None
+            for prefix, event, value in ijson.parse(response.raw, use_float=True):
+                if builder is not None:
+                    builder.event(event, value)
+                    if prefix == items_prefix and event in ('end_map', 'end_array'):
+                        items.append(builder.value)
+                        builder = None
+                elif prefix == items_prefix:
+                    if event in ('start_map', 'start_array') and len(items) < max_items:
+                        builder = ijson.ObjectBuilder()
+                        builder.event(event, value)
+                elif event in ('string', 'number', 'boolean', 'null') and not prefix.startswith(list_path + '.'):
+                    # Keep top-level scalars such as success, data.total, error.code
+                    node = data
+                    for key in prefix.split('.')[:-1]:
+                        node = node.setdefault(key, {})
+                    node[prefix.rsplit('.', 1)[-1]] = value
+
+        parent = _parent_node(data, list_path)
+        if parent is not None:
+            parent[list_key] = items
+        return data
+    except Exception as e:
+        print(f"Request failed: {e}")
+        return {'success': False, 'error': str(e)}
+
+def _field_value(data, field):
+    """Return the value at an ijson-style prefix, taking the first entry for 'item'"""
+    node = data
+    for key in field.split('.'):
+        if isinstance(node, list) and key == 'item' and node:
+            node = node[0]
+        elif isinstance(node, dict) and key in node:
+            node = node[key]
+        else:
+            raise KeyError(field)
+    return node
+
+def stream_fields_request(url, params, fields):
+    """Fetch a response, keeping only the scalar values at the given ijson prefixes
+
+    Returns a flat dict mapping each prefix that was found to its first
+    value, e.g. {'success': True, 'data.tasks.item.title': ...}. With ijson
+    installed nothing else is built and parsing stops once every field has
+    been seen; otherwise the whole response is decoded and the fields
+    picked out of it.
+    """
+    if ijson is None:
+        data = make_request(url, params)
+        result = {}
+        for field in fields:
+            try:
+                result[field] = _field_value(data, field)
+            except KeyError:
+                pass
+        return result
+
+    try:
+        with SESSION.get(url, params=params, timeout=10, stream=True) as response:
+            response.raw.decode_content = True
+            wanted = set(fields)
+            result = {}
+            for prefix, event, value in ijson.parse(response.raw, use_float=True):
+                if prefix in wanted and prefix not in result and event in ('string', 'number', 'boolean', 'null'):
+                    result[prefix] = value
+                    if len(result) == len(wanted):
+                        break
+        return result
+    except Exception as e:
+        print(f"Request failed: {e}")
+        return {'success': False, 'error': str(e)}
@@ -4,12 +4,10 @@ Test BT Search functionality in Synology Download Station
 Search for "Vera" to validate search works
 """
 
-import urllib.request
-import urllib.parse
-import json
+import io
 import sys
-import ssl
-import time
+from concurrent.futures import ThreadPoolExecutor
+from _synology_client import SynologySession, make_request, stream_list_request, wait_for_search
 
 # Configuration
 SYNOLOGY_HOST = "hostname"
@@ -18,23 +16,6 @@ USERNAME = "username"
 PASSWORD = "password"
 BASE_URL = f"http://{SYNOLOGY_HOST}:{SYNOLOGY_PORT}/webapi"
 
-# Create SSL context
-ssl_context = ssl.create_default_context()
-ssl_context.check_hostname = False
-ssl_context.verify_mode = ssl.CERT_NONE
-
-def make_request(url, params=None):
-    """Make HTTP request and return JSON response"""
-    if params:
-        url = f"{url}?{urllib.parse.urlencode(params)}"
-    
-    try:
-        with urllib.request.urlopen(url, context=ssl_context) as response:
-            return json.loads(response.read().decode('utf-8'))
-    except Exception as e:
-        print(f"Request failed: {e}")
-        return {'success': False, 'error': str(e)}
-
 def main():
     print("Synology Download Station - BT Search Test")
     print("=========================================")
@@ -42,43 +23,17 @@ def main():
     print(f"Search term: 'Vera'")
     print()
     
-    # Get API Info
-    params = {
-        'api': 'SYNO.API.Info',
-        'version': '1',
-        'method': 'query',
-        'query': 'SYNO.API.Auth,SYNO.DownloadStation.BTSearch'
-    }
-    
-    data = make_request(f"{BASE_URL}/query.cgi", params)
-    if not data['success']:
-        print("Failed to get API info!")
-        return 1
-    
-    api_info = data['data']
-    
-    # Login
+    # Log in; the session logs out again when the block exits
     print("1. Logging in...")
-    auth_info = api_info['SYNO.API.Auth']
-    params = {
-        'api': 'SYNO.API.Auth',
-        'version': '3',
-        'method': 'login',
-        'account': USERNAME,
-        'passwd': PASSWORD,
-        'session': 'DownloadStation',
-        'format': 'sid'
-    }
-    
-    data = make_request(f"{BASE_URL}/{auth_info['path']}", params)
-    if not data.get('success'):
-        print("Failed to login!")
-        return 1
-    
-    sid = data['data']['sid']
-    print("✓ Logged in successfully")
-    
-    try:
+    with SynologySession(BASE_URL, USERNAME, PASSWORD,
+                         'SYNO.API.Auth,SYNO.DownloadStation.BTSearch') as session:
+        if not session.sid:
+            return 1
+        
+        api_info = session.api_info
+        sid = session.sid
+        print("✓ Logged in successfully")
+        
         # Check if BTSearch API is available
         if 'SYNO.DownloadStation.BTSearch' not in api_info:
             print("✗ BTSearch API not available!")
@@ -86,18 +41,31 @@ def main():
         
         bt_info = api_info['SYNO.DownloadStation.BTSearch']
         
-        # Get available modules first
-        print("\n2. Getting available search modules...")
-        params = {
+        # Modules and categories are independent lookups, so fetch them
+        # concurrently over the shared session
+        module_params = {
             'api': 'SYNO.DownloadStation.BTSearch',
             'version': '1',
             'method': 'getModule',
             '_sid': sid
         }
+        category_params = {
+            'api': 'SYNO.DownloadStation.BTSearch',
+            'version': '1',
+            'method': 'getCategory',
+            '_sid': sid
+        }
         
-        data = make_request(f"{BASE_URL}/{bt_info['path']}", params)
-        if data['success']:
-            modules = data['data']['modules']
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            module_future = executor.submit(make_request, f"{BASE_URL}/{bt_info['path']}", module_params)
+            category_future = executor.submit(make_request, f"{BASE_URL}/{bt_info['path']}", category_params)
+            module_data = module_future.result()
+            category_data = category_future.result()
+        
+        # Get available modules first
+        print("\n2. Getting available search modules...")
+        if module_data['success']:
+            modules = module_data['data']['modules']
             enabled_modules = [m for m in modules if m['enabled']]
             print(f"✓ Found {len(enabled_modules)} enabled modules:")
             for module in enabled_modules:
@@ -105,16 +73,8 @@ def main():
         
         # Get categories
         print("\n3. Getting search categories...")
-        params = {
-            'api': 'SYNO.DownloadStation.BTSearch',
-            'version': '1',
-            'method': 'getCategory',
-            '_sid': sid
-        }
-        
-        data = make_request(f"{BASE_URL}/{bt_info['path']}", params)
-        if data['success']:
-            categories = data['data']['categories']
+        if category_data['success']:
+            categories = category_data['data']['categories']
             print(f"✓ Found {len(categories)} categories:")
             for cat in categories[:5]:  # Show first 5
                 print(f"  - {cat['title']} (id: {cat['id']})")
@@ -138,12 +98,8 @@ def main():
         task_id = data['data']['taskid']
         print(f"✓ Search started with task ID: {task_id}")
         
-        # Wait a bit for search to process
-        print("\n5. Waiting for search results...")
-        time.sleep(3)
-        
-        # Get search results
-        print("\n6. Retrieving search results...")
+        # Poll the results page until the search finishes; the last page
+        # polled doubles as the results, so no separate fetch is needed
         params = {
             'api': 'SYNO.DownloadStation.BTSearch',
             'version': '1',
@@ -156,26 +112,36 @@ def main():
             '_sid': sid
         }
         
-        data = make_request(f"{BASE_URL}/{bt_info['path']}", params)
+        print("\n5. Waiting for search results...")
+        # Only the top 10 results are shown, so don't build the rest
+        data = wait_for_search(
+            lambda: stream_list_request(f"{BASE_URL}/{bt_info['path']}", params, 'data.items.item', 10)
+        )
+        
+        # Report search results
+        print("\n6. Retrieving search results...")
         if data['success']:
             results = data['data']
             print(f"✓ Search completed: {results['finished']}")
             print(f"✓ Total results: {results['total']}")
             
             if results['items']:
-                print(f"\nTop {min(10, len(results['items']))} results:")
+                # Build the report in memory and write it once
+                buf = io.StringIO()
+                buf.write(f"\nTop {min(10, len(results['items']))} results:\n")
                 for i, item in enumerate(results['items'][:10], 1):
                     size_mb = int(item['size']) / (1024 * 1024)
                     size_gb = size_mb / 1024
                     size_str = f"{size_gb:.2f} GB" if size_gb > 1 else f"{size_mb:.0f} MB"
                     
-                    print(f"\n{i}. {item['title']}")
-                    print(f"   Size: {size_str}")
-                    print(f"   Seeds: {item['seeds']} | Leeches: {item['leechs']}")
-                    print(f"   Date: {item['date']}")
-                    print(f"   Module: {item['module_title']}")
+                    buf.write(f"\n{i}. {item['title']}\n"
+                              f"   Size: {size_str}\n"
+                              f"   Seeds: {item['seeds']} | Leeches: {item['leechs']}\n"
+                              f"   Date: {item['date']}\n"
+                              f"   Module: {item['module_title']}\n")
                     if 'download_uri' in item:
-                        print(f"   Download: {item['download_uri'][:50]}...")
+                        buf.write(f"   Download: {item['download_uri'][:50]}...\n")
+                sys.stdout.write(buf.getvalue())
             else:
                 print("No results found!")
         else:
@@ -195,21 +161,6 @@ def main():
         if data['success']:
             print("✓ Search task cleaned up")
         
-    finally:
-        # Logout
-        print("\nLogging out...")
-        params = {
-            'api': 'SYNO.API.Auth',
-            'version': '1',
-            'method': 'logout',
-            'session': 'DownloadStation',
-            '_sid': sid
-        }
-        
-        data = make_request(f"{BASE_URL}/{auth_info['path']}", params)
-        if data['success']:
-            print("✓ Logged out successfully")
-    
     return 0
 
 if __name__ == "__main__":
@@ -3,12 +3,11 @@
 Test creating a download task from BT search result
 """
 
-import urllib.request
 import urllib.parse
-import json
 import sys
-import ssl
 import time
+from concurrent.futures import ThreadPoolExecutor
+from _synology_client import SynologySession, make_request, wait_for_search
 
 # Configuration
 SYNOLOGY_HOST = "hostname"
@@ -17,22 +16,25 @@ USERNAME = "username"
 PASSWORD = "password"
 BASE_URL = f"http://{SYNOLOGY_HOST}:{SYNOLOGY_PORT}/webapi"
 
-# Create SSL context
-ssl_context = ssl.create_default_context()
-ssl_context.check_hostname = False
-ssl_context.verify_mode = ssl.CERT_NONE
+# Number of top search results to queue, and how many create requests may be
+# in flight at once (kept within the shared session's connection pool)
+MAX_DOWNLOADS = 1
+CREATE_WORKERS = 4
 
-def make_request(url, params=None):
-    """Make HTTP request and return JSON response"""
-    if params:
-        url = f"{url}?{urllib.parse.urlencode(params)}"
-    
-    try:
-        with urllib.request.urlopen(url, context=ssl_context) as response:
-            return json.loads(response.read().decode('utf-8'))
-    except Exception as e:
-        print(f"Request failed: {e}")
-        return {'success': False, 'error': str(e)}
+# Search results to fetch; spare candidates cover results without a magnet link
+SEARCH_LIMIT = max(5, 2 * MAX_DOWNLOADS)
+
+def create_download_task(url, uri, sid):
+    """Create a Download Station task for uri and return the JSON response"""
+    params = {
+        'api': 'SYNO.DownloadStation.Task',
+        'version': '1',
+        'method': 'create',
+        'uri': uri,
+        '_sid': sid
+    }
+    # POST keeps long magnet URIs out of the query string and the server's access log
+    return make_request(url, data=params)
 
 def main():
     print("Synology Download Station - Search and Download Test")
@@ -40,34 +42,16 @@ def main():
     print(f"Host: {SYNOLOGY_HOST}:{SYNOLOGY_PORT}")
     print()
     
-    # Get API Info and login (simplified for brevity)
-    params = {
-        'api': 'SYNO.API.Info',
-        'version': '1',
-        'method': 'query',
-        'query': 'SYNO.API.Auth,SYNO.DownloadStation.Task,SYNO.DownloadStation.BTSearch'
-    }
-    
-    data = make_request(f"{BASE_URL}/query.cgi", params)
-    api_info = data['data']
-    
-    # Login
-    auth_info = api_info['SYNO.API.Auth']
-    params = {
-        'api': 'SYNO.API.Auth',
-        'version': '3',
-        'method': 'login',
-        'account': USERNAME,
-        'passwd': PASSWORD,
-        'session': 'DownloadStation',
-        'format': 'sid'
-    }
-    
-    data = make_request(f"{BASE_URL}/{auth_info['path']}", params)
-    sid = data['data']['sid']
-    print("✓ Logged in successfully")
-    
-    try:
+    # Log in; the session logs out again when the block exits
+    with SynologySession(BASE_URL, USERNAME, PASSWORD,
+                         'SYNO.API.Auth,SYNO.DownloadStation.Task,SYNO.DownloadStation.BTSearch') as session:
+        if not session.sid:
+            return 1
+        
+        api_info = session.api_info
+        sid = session.sid
+        print("✓ Logged in successfully")
+        
         # Search for a small torrent (Ubuntu)
         print("\n1. Searching for 'ubuntu 24.04'...")
         bt_info = api_info['SYNO.DownloadStation.BTSearch']
@@ -84,55 +68,59 @@ def main():
         task_id = data['data']['taskid']
         print(f"✓ Search started (ID: {task_id})")
         
-        # Wait for results
-        time.sleep(3)
-        
-        # Get results
+        # Poll for results, stopping as soon as the search has finished
         params = {
             'api': 'SYNO.DownloadStation.BTSearch',
             'version': '1',
             'method': 'list',
             'taskid': task_id,
             'offset': 0,
-            'limit': 5,
+            'limit': SEARCH_LIMIT,
             'sort_by': 'seeds',
             'sort_direction': 'DESC',
             '_sid': sid
         }
         
-        data = make_request(f"{BASE_URL}/{bt_info['path']}", params)
+        # The poll sends identical params each time, so encode the URL once
+        list_url = f"{BASE_URL}/{bt_info['path']}?{urllib.parse.urlencode(params)}"
+        data = wait_for_search(lambda: make_request(list_url))
         results = data['data']
         
         if results['items']:
             print(f"\n✓ Found {len(results['items'])} results")
             
-            # Pick the first result with good seeds
-            selected = results['items'][0]
-            print(f"\n2. Selected torrent:")
-            print(f"   Title: {selected['title']}")
-            print(f"   Size: {int(selected['size']) / (1024*1024*1024):.2f} GB")
-            print(f"   Seeds: {selected['seeds']}")
+            # Pick the best-seeded results that have a magnet link
+            selected = [item for item in results['items']
+                        if item.get('download_uri', '').startswith('magnet:')][:MAX_DOWNLOADS]
             
-            # Create download task with the magnet link
-            if 'download_uri' in selected and selected['download_uri'].startswith('magnet:'):
+            if selected:
+                print(f"\n2. Selected {len(selected)} torrent(s):")
+                for item in selected:
+                    print(f"   Title: {item['title']}")
+                    print(f"   Size: {int(item['size']) / (1024*1024*1024):.2f} GB")
+                    print(f"   Seeds: {item['seeds']}")
+                
+                # Create the download tasks concurrently, a bounded number at a time
                 print(f"\n3. Adding to download queue...")
                 task_info = api_info['SYNO.DownloadStation.Task']
-                params = {
-                    'api': 'SYNO.DownloadStation.Task',
-                    'version': '1',
-                    'method': 'create',
-                    'uri': selected['download_uri'],
-                    '_sid': sid
-                }
+                task_url = f"{BASE_URL}/{task_info['path']}"
+                with ThreadPoolExecutor(max_workers=CREATE_WORKERS) as executor:
+                    responses = list(executor.map(
+                        lambda item: create_download_task(task_url, item['download_uri'], sid),
+                        selected
+                    ))
                 
-                data = make_request(f"{BASE_URL}/{task_info['path']}", params)
-                if data['success']:
-                    print("✓ Download task created successfully!")
-                    
-                    # Verify by listing recent tasks
-                    print("\n4. Verifying download task...")
-                    time.sleep(2)
-                    
+                created = []
+                for item, data in zip(selected, responses):
+                    if data['success']:
+                        print(f"✓ Download task created: {item['title']}")
+                        created.append(item)
+                    else:
+                        print(f"✗ Failed to create task for {item['title']}: {data}")
+                
+                if created:
+                    # Verify by polling recent tasks until the new ones show up
+                    print("\n4. Verifying download tasks...")
                     params = {
                         'api': 'SYNO.DownloadStation.Task',
                         'version': '1',
@@ -143,18 +131,27 @@ def main():
                         '_sid': sid
                     }
                     
-                    data = make_request(f"{BASE_URL}/{task_info['path']}", params)
-                    if data['success']:
-                        for task in data['data']['tasks']:
-                            if selected['title'] in task['title']:
-                                print(f"✓ Found new task: {task['title']}")
-                                print(f"  Status: {task['status']}")
-                                print(f"  Type: {task['type']}")
-                                break
-                else:
-                    print(f"✗ Failed to create task: {data}")
+                    list_url = f"{task_url}?{urllib.parse.urlencode(params)}"
+                    new_tasks = {}
+                    for _ in range(4):
+                        time.sleep(0.5)
+                        data = make_request(list_url)
+                        if not data['success']:
+                            break
+                        for item in created:
+                            for task in data['data']['tasks']:
+                                if item['title'] in task['title']:
+                                    new_tasks[item['title']] = task
+                                    break
+                        if len(new_tasks) == len(created):
+                            break
+                    
+                    for new_task in new_tasks.values():
+                        print(f"✓ Found new task: {new_task['title']}")
+                        print(f"  Status: {new_task['status']}")
+                        print(f"  Type: {new_task['type']}")
             else:
-                print("✗ No magnet link available for this result")
+                print("✗ No magnet link available for the selected results")
         
         # Clean up search
         params = {
@@ -166,18 +163,6 @@ def main():
         }
         make_request(f"{BASE_URL}/{bt_info['path']}", params)
         
-    finally:
-        # Logout
-        params = {
-            'api': 'SYNO.API.Auth',
-            'version': '1',
-            'method': 'logout',
-            'session': 'DownloadStation',
-            '_sid': sid
-        }
-        make_request(f"{BASE_URL}/{auth_info['path']}", params)
-        print("\n✓ Logged out")
-    
     return 0
 
 if __name__ == "__main__":
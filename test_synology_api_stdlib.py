@@ -9,7 +9,7 @@ import urllib.request
 import urllib.parse
 import json
 import sys
-import ssl
+from types import MappingProxyType
 
 # Configuration
 SYNOLOGY_HOST = "hostname"
@@ -18,10 +18,27 @@ USERNAME = "username"
 PASSWORD = "password"
 BASE_URL = f"http://{SYNOLOGY_HOST}:{SYNOLOGY_PORT}/webapi"
 
-# Create SSL context that doesn't verify certificates (for testing only)
-ssl_context = ssl.create_default_context()
-ssl_context.check_hostname = False
-ssl_context.verify_mode = ssl.CERT_NONE
+# Error messages for SYNO.API.Auth login failures
+_AUTH_ERRORS = MappingProxyType({
+    400: "No such account or incorrect password",
+    401: "Account disabled",
+    402: "Permission denied",
+    403: "2-step verification code required",
+    404: "Failed to authenticate 2-step verification code"
+})
+
+# Error messages for SYNO.DownloadStation.Task failures
+_TASK_ERRORS = MappingProxyType({
+    400: "File upload failed",
+    401: "Max number of tasks reached",
+    402: "Destination denied",
+    403: "Destination does not exist",
+    404: "Invalid task id",
+    405: "Invalid task action",
+    406: "No default destination",
+    407: "Set destination failed",
+    408: "File does not exist"
+})
 
 class SynologyDownloadStation:
     def __init__(self, host, port, username, password):
@@ -39,8 +56,8 @@ class SynologyDownloadStation:
             url = f"{url}?{urllib.parse.urlencode(params)}"
         
         try:
-            with urllib.request.urlopen(url, context=ssl_context) as response:
-                return json.loads(response.read().decode('utf-8'))
+            with urllib.request.urlopen(url) as response:
+                return json.loads(response.read())
         except Exception as e:
             print(f"Request failed: {e}")
             return {'success': False, 'error': str(e)}
@@ -99,20 +116,13 @@ class SynologyDownloadStation:
             print(f"✓ Login successful! Session ID: {self.sid[:10]}...")
             return True
         else:
-            error_codes = {
-                400: "No such account or incorrect password",
-                401: "Account disabled",
-                402: "Permission denied",
-                403: "2-step verification code required",
-                404: "Failed to authenticate 2-step verification code"
-            }
             error_value = data.get('error')
             if isinstance(error_value, dict):
                 # If error is a dict, try to get the code from it
                 error_code = error_value.get('code', 0)
-                error_msg = error_codes.get(error_code, f"Error details: {json.dumps(error_value)}")
+                error_msg = _AUTH_ERRORS.get(error_code, f"Error details: {json.dumps(error_value)}")
             else:
-                error_msg = error_codes.get(error_value, f"Unknown error: {error_value}")
+                error_msg = _AUTH_ERRORS.get(error_value, f"Unknown error: {error_value}")
             print(f"✗ Login failed: {error_msg}")
             print(f"  Full response: {json.dumps(data, indent=2)}")
             return False
@@ -221,18 +231,12 @@ class SynologyDownloadStation:
             print("✓ Task created successfully!")
             return True
         else:
-            error_codes = {
-                400: "File upload failed",
-                401: "Max number of tasks reached",
-                402: "Destination denied",
-                403: "Destination does not exist",
-                404: "Invalid task id",
-                405: "Invalid task action",
-                406: "No default destination",
-                407: "Set destination failed",
-                408: "File does not exist"
-            }
-            error_msg = error_codes.get(data.get('error', 0), f"Unknown error: {data.get('error', 'Unknown')}")
+            error_value = data.get('error')
+            if isinstance(error_value, dict):
+                error_code = error_value.get('code', 0)
+                error_msg = _TASK_ERRORS.get(error_code, f"Error: {json.dumps(error_value)}")
+            else:
+                error_msg = _TASK_ERRORS.get(error_value, f"Unknown error: {error_value}")
             print(f"✗ Failed to create task: {error_msg}")
             return False
     
@@ -3,11 +3,12 @@
 Test various task operations in Synology Download Station
 """
 
-import urllib.request
-import urllib.parse
-import json
+import argparse
 import sys
-import ssl
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from urllib.parse import quote
+from _synology_client import clear_cached_sid, load_cached_sid, make_request, store_cached_sid, stream_fields_request
 
 # Configuration
 SYNOLOGY_HOST = "hostname"
@@ -16,24 +17,32 @@ USERNAME = "username"
 PASSWORD = "password"
 BASE_URL = f"http://{SYNOLOGY_HOST}:{SYNOLOGY_PORT}/webapi"
 
-# Create SSL context
-ssl_context = ssl.create_default_context()
-ssl_context.check_hostname = False
-ssl_context.verify_mode = ssl.CERT_NONE
+# Fields printed from the task getinfo response, which can be large with
+# additional data, so only these are parsed out of it
+TASK_FIELDS = (
+    'success',
+    'data.tasks.item.title',
+    'data.tasks.item.status',
+    'data.tasks.item.size',
+    'data.tasks.item.additional.detail.destination',
+    'data.tasks.item.additional.detail.create_time',
+    'data.tasks.item.additional.transfer.size_downloaded'
+)
 
-def make_request(url, params=None):
-    """Make HTTP request and return JSON response"""
-    if params:
-        url = f"{url}?{urllib.parse.urlencode(params)}"
-    
-    try:
-        with urllib.request.urlopen(url, context=ssl_context) as response:
-            return json.loads(response.read().decode('utf-8'))
-    except Exception as e:
-        print(f"Request failed: {e}")
-        return {'success': False, 'error': str(e)}
+def endpoint_url(api_info, api):
+    """Return the full URL of an API, or None if the NAS does not provide it"""
+    return f"{BASE_URL}/{api_info[api]['path']}" if api in api_info else None
+
+def api_url_prefix(url, api, sid):
+    """Build an API's URL up to the method, with the constant parameters encoded once"""
+    return f"{url}?api={api}&version=1&_sid={quote(sid)}&"
 
 def main():
+    parser = argparse.ArgumentParser(description="Test various task operations in Synology Download Station")
+    parser.add_argument('--keep-sid', action='store_true',
+                        help="skip logout and cache the session for the next run")
+    args = parser.parse_args()
+    
     print("Synology Download Station - Task Operations Test")
     print("===============================================")
     print(f"Host: {SYNOLOGY_HOST}:{SYNOLOGY_PORT}")
@@ -44,7 +53,7 @@ def main():
         'api': 'SYNO.API.Info',
         'version': '1',
         'method': 'query',
-        'query': 'SYNO.API.Auth,SYNO.DownloadStation.Task,SYNO.DownloadStation.BTSearch'
+        'query': 'SYNO.API.Auth,SYNO.DownloadStation.Task,SYNO.DownloadStation.BTSearch,SYNO.DownloadStation.Statistic'
     }
     
     data = make_request(f"{BASE_URL}/query.cgi", params)
@@ -54,70 +63,97 @@ def main():
     
     api_info = data['data']
     
-    # Login
-    auth_info = api_info['SYNO.API.Auth']
-    params = {
-        'api': 'SYNO.API.Auth',
-        'version': '3',
-        'method': 'login',
-        'account': USERNAME,
-        'passwd': PASSWORD,
-        'session': 'DownloadStation',
-        'format': 'sid'
-    }
+    # Resolve every endpoint URL once
+    endpoints = SimpleNamespace(
+        auth=endpoint_url(api_info, 'SYNO.API.Auth'),
+        task=endpoint_url(api_info, 'SYNO.DownloadStation.Task'),
+        bt=endpoint_url(api_info, 'SYNO.DownloadStation.BTSearch'),
+        stat=endpoint_url(api_info, 'SYNO.DownloadStation.Statistic')
+    )
     
-    data = make_request(f"{BASE_URL}/{auth_info['path']}", params)
-    if not data.get('success'):
-        print("Failed to login!")
-        return 1
+    # Reuse the sid cached by an earlier --keep-sid run if DSM still accepts it;
+    # an expired or invalid session (error 105/106/107/119) falls through to login.
+    # When the NAS has the Statistic API, the probe doubles as Test 3's request.
+    sid = load_cached_sid(SYNOLOGY_HOST, USERNAME)
+    stat_data = None
+    if sid:
+        if endpoints.stat:
+            probe_url = api_url_prefix(endpoints.stat, 'SYNO.DownloadStation.Statistic', sid) + "method=getinfo"
+        else:
+            probe_url = api_url_prefix(endpoints.task, 'SYNO.DownloadStation.Task', sid) + "method=list&limit=0"
+        
+        data = make_request(probe_url)
+        if data.get('success'):
+            print("✓ Reusing cached session")
+            if endpoints.stat:
+                stat_data = data
+        else:
+            sid = None
     
-    sid = data['data']['sid']
-    print(f"✓ Logged in successfully")
+    # Login
+    if not sid:
+        params = {
+            'api': 'SYNO.API.Auth',
+            'version': '3',
+            'method': 'login',
+            'account': USERNAME,
+            'passwd': PASSWORD,
+            'session': 'DownloadStation',
+            'format': 'sid'
+        }
+        
+        data = make_request(endpoints.auth, params)
+        if not data.get('success'):
+            print("Failed to login!")
+            return 1
+        
+        sid = data['data']['sid']
+        print(f"✓ Logged in successfully")
+        if args.keep_sid:
+            store_cached_sid(SYNOLOGY_HOST, USERNAME, sid)
     
     try:
+        # The three probes are independent, so run them concurrently and
+        # report the results in order
+        task_url_prefix = api_url_prefix(endpoints.task, 'SYNO.DownloadStation.Task', sid)
+        
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            task_future = executor.submit(stream_fields_request,
+                                          task_url_prefix + "method=getinfo&id=dbid_1&additional=detail,transfer",
+                                          None, TASK_FIELDS)
+            
+            module_future = None
+            if endpoints.bt:
+                bt_url_prefix = api_url_prefix(endpoints.bt, 'SYNO.DownloadStation.BTSearch', sid)
+                module_future = executor.submit(make_request, bt_url_prefix + "method=getModule")
+            
+            # The Statistic path came back with the initial API info query
+            stat_future = None
+            if endpoints.stat and stat_data is None:
+                stat_url_prefix = api_url_prefix(endpoints.stat, 'SYNO.DownloadStation.Statistic', sid)
+                stat_future = executor.submit(make_request, stat_url_prefix + "method=getinfo")
+        
         # Test 1: Get task info for a specific task
         print("\n1. Getting detailed info for task dbid_1...")
-        task_info = api_info['SYNO.DownloadStation.Task']
-        params = {
-            'api': 'SYNO.DownloadStation.Task',
-            'version': '1',
-            'method': 'getinfo',
-            'id': 'dbid_1',
-            'additional': 'detail,transfer,file,tracker,peer',
-            '_sid': sid
-        }
-        
-        data = make_request(f"{BASE_URL}/{task_info['path']}", params)
-        if data['success'] and data['data']['tasks']:
-            task = data['data']['tasks'][0]
+        fields = task_future.result()
+        if fields.get('success') and 'data.tasks.item.title' in fields:
             print(f"✓ Task info retrieved:")
-            print(f"  Title: {task['title']}")
-            print(f"  Status: {task['status']}")
-            print(f"  Size: {int(task['size']) / (1024*1024*1024):.2f} GB")
+            print(f"  Title: {fields['data.tasks.item.title']}")
+            print(f"  Status: {fields['data.tasks.item.status']}")
+            size_gb = int(fields['data.tasks.item.size']) * (1.0 / (1 << 30))
+            print(f"  Size: {size_gb:.2f} GB")
             
-            if 'additional' in task:
-                if 'detail' in task['additional']:
-                    detail = task['additional']['detail']
-                    print(f"  Destination: {detail['destination']}")
-                    print(f"  Created: {detail['create_time']}")
-                if 'transfer' in task['additional']:
-                    transfer = task['additional']['transfer']
-                    print(f"  Downloaded: {int(transfer['size_downloaded']) / (1024*1024):.2f} MB")
+            if 'data.tasks.item.additional.detail.destination' in fields:
+                print(f"  Destination: {fields['data.tasks.item.additional.detail.destination']}")
+                print(f"  Created: {fields['data.tasks.item.additional.detail.create_time']}")
+            if 'data.tasks.item.additional.transfer.size_downloaded' in fields:
+                downloaded_mb = int(fields['data.tasks.item.additional.transfer.size_downloaded']) * (1.0 / (1 << 20))
+                print(f"  Downloaded: {downloaded_mb:.2f} MB")
         
         # Test 2: Test BT Search API if available
-        if 'SYNO.DownloadStation.BTSearch' in api_info:
+        if module_future:
             print("\n2. Testing BT Search API...")
-            bt_info = api_info['SYNO.DownloadStation.BTSearch']
-            
-            # Get available modules
-            params = {
-                'api': 'SYNO.DownloadStation.BTSearch',
-                'version': '1',
-                'method': 'getModule',
-                '_sid': sid
-            }
-            
-            data = make_request(f"{BASE_URL}/{bt_info['path']}", params)
+            data = module_future.result()
             if data['success']:
                 modules = data['data']['modules']
                 print(f"✓ Found {len(modules)} BT search modules:")
@@ -127,49 +163,33 @@ def main():
         
         # Test 3: Get download statistics
         print("\n3. Getting download statistics...")
-        params = {
-            'api': 'SYNO.DownloadStation.Statistic',
-            'version': '1',
-            'method': 'getinfo',
-            '_sid': sid
-        }
+        data = stat_future.result() if stat_future else stat_data
+        if data and data['success']:
+            stats = data['data']
+            print("✓ Download statistics:")
+            print(f"  Download speed: {stats['speed_download'] / 1024:.2f} KB/s")
+            print(f"  Upload speed: {stats['speed_upload'] / 1024:.2f} KB/s")
+            print(f"  eMule download: {stats['emule_speed_download'] / 1024:.2f} KB/s")
+            print(f"  eMule upload: {stats['emule_speed_upload'] / 1024:.2f} KB/s")
         
-        # Try to find the statistic API path
-        stat_params = {
-            'api': 'SYNO.API.Info',
-            'version': '1',
-            'method': 'query',
-            'query': 'SYNO.DownloadStation.Statistic'
-        }
-        stat_data = make_request(f"{BASE_URL}/query.cgi", stat_params)
-        
-        if stat_data['success'] and 'SYNO.DownloadStation.Statistic' in stat_data['data']:
-            stat_info = stat_data['data']['SYNO.DownloadStation.Statistic']
-            params['_sid'] = sid
+    finally:
+        if args.keep_sid:
+            print("\nKeeping session for the next run (--keep-sid)")
+        else:
+            # Logout
+            print("\nLogging out...")
+            params = {
+                'api': 'SYNO.API.Auth',
+                'version': '1',
+                'method': 'logout',
+                'session': 'DownloadStation',
+                '_sid': sid
+            }
             
-            data = make_request(f"{BASE_URL}/{stat_info['path']}", params)
+            data = make_request(endpoints.auth, params)
             if data['success']:
-                stats = data['data']
-                print("✓ Download statistics:")
-                print(f"  Download speed: {stats['speed_download'] / 1024:.2f} KB/s")
-                print(f"  Upload speed: {stats['speed_upload'] / 1024:.2f} KB/s")
-                print(f"  eMule download: {stats['emule_speed_download'] / 1024:.2f} KB/s")
-                print(f"  eMule upload: {stats['emule_speed_upload'] / 1024:.2f} KB/s")
-        
-    finally:
-        # Logout
-        print("\nLogging out...")
-        params = {
-            'api': 'SYNO.API.Auth',
-            'version': '1',
-            'method': 'logout',
-            'session': 'DownloadStation',
-            '_sid': sid
-        }
-        
-        data = make_request(f"{BASE_URL}/{auth_info['path']}", params)
-        if data['success']:
-            print("✓ Logged out successfully")
+                print("✓ Logged out successfully")
+            clear_cached_sid(SYNOLOGY_HOST, USERNAME)
     
     return 0
 